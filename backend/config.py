@@ -6,6 +6,10 @@ class Settings(BaseSettings):
     database_url: Optional[str] = None
     supabase_url: Optional[str] = None
     supabase_key: Optional[str] = None
+    db_pool_size: int = 20
+    db_max_overflow: int = 40
+    db_pool_timeout: int = 30  # Seconds to wait for a free connection
+    db_pool_recycle: int = 1800  # Seconds before a pooled connection is replaced
     
     # API Configuration
     api_title: str = "AI Chat Support API"
@@ -20,6 +24,8 @@ class Settings(BaseSettings):
     # LLM Configuration
     gemini_api_key: Optional[str] = None
     openai_api_key: Optional[str] = None
+    llm_cache_ttl: int = 3600  # Seconds to reuse a response for the same prompt and context; 0 disables
+    llm_cache_size: int = 1024
     
     # File Upload
     upload_dir: str = "./uploads"
@@ -28,8 +34,15 @@ class Settings(BaseSettings):
     
     # RAG Configuration
     embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2"
+    embedding_backend: str = "onnx"  # "onnx" or "torch"
+    embedding_onnx_file: str = "onnx/model_qint8_avx512_vnni.onnx"  # Quantized export shipped with the model repo
     chunk_size: int = 1000
     chunk_overlap: int = 200
+    embedding_batch_size: int = 64
+    query_embedding_cache_size: int = 4096
+    numba_scoring_threshold: int = 256 * 1024  # Cached embedding values (chunks x dim) before the Numba kernel is used
+    embedding_cache_ttl: int = 300  # Seconds before a tenant's cached embedding matrix is reloaded
+    hnsw_ef_search: int = 200  # HNSW candidate list size; the tenant filter is applied to these candidates
     
     class Config:
         env_file = ".env"
@@ -1,39 +1,113 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.pool import StaticPool
 from contextlib import contextmanager
 from typing import Generator
 from config import settings
-from models import Base
+from models import Base, EMBEDDING_DIMENSION, PGVECTOR_AVAILABLE, uses_pgvector
 
 # Database URL - use Supabase PostgreSQL URL if available, otherwise fallback
 DATABASE_URL = settings.database_url or settings.supabase_url or "sqlite:///./chat_support.db"
 
 # Create engine
 if DATABASE_URL.startswith("sqlite"):
-    # SQLite for development
+    # SQLite for development. An in-memory database only exists on a single
+    # connection; file databases get a regular pool so threadpool workers
+    # don't share one connection.
     engine = create_engine(
         DATABASE_URL,
         connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
+        poolclass=StaticPool if ":memory:" in DATABASE_URL else None,
     )
 else:
     # PostgreSQL for production
     engine = create_engine(
         DATABASE_URL,
         pool_pre_ping=True,
-        pool_recycle=300,
-        pool_size=10,
-        max_overflow=20
+        pool_recycle=settings.db_pool_recycle,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout
     )
 
+# Extension version, and the current type of document_chunks.embedding
+# (NULL if the table hasn't been created yet)
+VECTOR_SUPPORT_QUERY = (
+    "SELECT (SELECT extversion FROM pg_extension WHERE extname = 'vector'), "
+    "(SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+    "WHERE attrelid = to_regclass('document_chunks') "
+    "AND attname = 'embedding' AND NOT attisdropped)"
+)
+VECTOR_COLUMN_TYPE = f"vector({EMBEDDING_DIMENSION})"
+
+def _record_vector_support(dialect, extension_version, column_type) -> bool:
+    """Enable pgvector search only if the extension exists and the embedding
+    column is (or will be created as) a vector column"""
+    enabled = extension_version is not None and column_type in (None, VECTOR_COLUMN_TYPE)
+    if extension_version is not None and not enabled:
+        print(
+            f"Warning: document_chunks.embedding is {column_type}, not {VECTOR_COLUMN_TYPE}; "
+            "pgvector search is disabled until the column is migrated"
+        )
+    dialect.has_vector_extension = enabled
+    dialect.vector_extension_version = (
+        tuple(int(part) for part in extension_version.split(".") if part.isdigit())
+        if extension_version else None
+    )
+    return enabled
+
+if PGVECTOR_AVAILABLE and engine.dialect.name == "postgresql":
+    @event.listens_for(engine, "first_connect")
+    def _detect_vector_extension(dbapi_connection, connection_record):
+        """Record once per engine whether pgvector search can be used"""
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(VECTOR_SUPPORT_QUERY)
+            _record_vector_support(engine.dialect, *cursor.fetchone())
+        finally:
+            cursor.close()
+            dbapi_connection.rollback()
+
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def enable_vector_extension(bind: Engine) -> bool:
+    """Try to enable pgvector and record whether search can use it.
+    
+    Returns False (and similarity search stays in Python) when the pgvector
+    package is missing, the database isn't PostgreSQL, the extension can't
+    be created on the server, or an existing document_chunks table still has
+    a non-vector embedding column.
+    """
+    if not PGVECTOR_AVAILABLE or bind.dialect.name != "postgresql":
+        return False
+    
+    try:
+        with bind.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+    except Exception as e:
+        print(f"Warning: could not create the pgvector extension: {e}")
+    
+    with bind.connect() as conn:
+        extension_version, column_type = conn.execute(text(VECTOR_SUPPORT_QUERY)).one()
+    return _record_vector_support(bind.dialect, extension_version, column_type)
+
+def create_vector_index(bind: Engine):
+    """Create the HNSW index used for cosine similarity search"""
+    if uses_pgvector(bind.dialect):
+        with bind.begin() as conn:
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_document_chunks_embedding_hnsw "
+                "ON document_chunks USING hnsw (embedding vector_cosine_ops)"
+            ))
+
 # Create tables
 def create_tables():
     """Create all tables in the database"""
+    enable_vector_extension(engine)
     Base.metadata.create_all(bind=engine)
+    create_vector_index(engine)
 
 def get_db() -> Generator[Session, None, None]:
     """Dependency to get database session"""
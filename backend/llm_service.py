@@ -1,59 +1,124 @@
+import hashlib
 import json
-from typing import Optional, Dict, Any
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple, Callable, Awaitable
 from config import settings
 
+GEMINI_MODEL = "gemini-pro"
+OPENAI_MODEL = "gpt-3.5-turbo"
+
 class LLMService:
     def __init__(self):
         self.gemini_client = None
         self.openai_client = None
-        self._initialize_clients()
+        # Clients and their SDKs are only loaded on first use
+        self._gemini_initialized = False
+        self._openai_initialized = False
+        self._client_lock = threading.Lock()
+        # cache key -> (expires_at, response), oldest first
+        self._response_cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
     
-    def _initialize_clients(self):
-        """Initialize LLM clients based on available API keys"""
-        # Initialize Gemini
-        if settings.gemini_api_key:
-            try:
-                import google.generativeai as genai
-                genai.configure(api_key=settings.gemini_api_key)
-                self.gemini_client = genai.GenerativeModel('gemini-pro')
-                print("Initialized Gemini client")
-            except ImportError:
-                print("Warning: google-generativeai not available")
-            except Exception as e:
-                print(f"Error initializing Gemini: {e}")
-        
-        # Initialize OpenAI (fallback)
-        if settings.openai_api_key:
-            try:
-                import openai
-                openai.api_key = settings.openai_api_key
-                self.openai_client = openai
-                print("Initialized OpenAI client")
-            except ImportError:
-                print("Warning: openai not available")
-            except Exception as e:
-                print(f"Error initializing OpenAI: {e}")
+    def _get_gemini(self):
+        """Lazily initialize the Gemini client if an API key is configured"""
+        if not self._gemini_initialized:
+            with self._client_lock:
+                if not self._gemini_initialized:
+                    if settings.gemini_api_key:
+                        try:
+                            import google.generativeai as genai
+                            genai.configure(api_key=settings.gemini_api_key)
+                            self.gemini_client = genai.GenerativeModel(GEMINI_MODEL)
+                            print("Initialized Gemini client")
+                        except ImportError:
+                            print("Warning: google-generativeai not available")
+                        except Exception as e:
+                            print(f"Error initializing Gemini: {e}")
+                    self._gemini_initialized = True
+        return self.gemini_client
+    
+    def _get_openai(self):
+        """Lazily initialize the OpenAI client if an API key is configured"""
+        if not self._openai_initialized:
+            with self._client_lock:
+                if not self._openai_initialized:
+                    if settings.openai_api_key:
+                        try:
+                            import openai
+                            openai.api_key = settings.openai_api_key
+                            self.openai_client = openai
+                            print("Initialized OpenAI client")
+                        except ImportError:
+                            print("Warning: openai not available")
+                        except Exception as e:
+                            print(f"Error initializing OpenAI: {e}")
+                    self._openai_initialized = True
+        return self.openai_client
     
     async def generate_response(self, prompt: str, context: Optional[str] = None) -> str:
         """Generate AI response using available LLM"""
         
         # Try Gemini first
-        if self.gemini_client:
+        if self._get_gemini():
             try:
-                return await self._generate_gemini_response(prompt, context)
+                return await self._cached_generate(GEMINI_MODEL, self._generate_gemini_response, prompt, context)
             except Exception as e:
                 print(f"Gemini error: {e}")
         
         # Try OpenAI as fallback
-        if self.openai_client:
+        if self._get_openai():
             try:
-                return await self._generate_openai_response(prompt, context)
+                return await self._cached_generate(OPENAI_MODEL, self._generate_openai_response, prompt, context)
             except Exception as e:
                 print(f"OpenAI error: {e}")
         
         # Fallback to mock response
         return self._generate_mock_response(prompt, context)
     
+    async def _cached_generate(
+        self,
+        model: str,
+        generate: Callable[[str, Optional[str]], Awaitable[str]],
+        prompt: str,
+        context: Optional[str]
+    ) -> str:
+        """Return a cached response for (model, prompt, context) or generate and cache one"""
+        key = self._cache_key(model, prompt, context)
+        cached = self._get_cached_response(key)
+        if cached is not None:
+            return cached
+        
+        response = await generate(prompt, context)
+        self._set_cached_response(key, response)
+        return response
+    
+    def _cache_key(self, model: str, prompt: str, context: Optional[str]) -> str:
+        # blake2b is faster than sha256 for short inputs; the key needs no cryptographic strength
+        data = f"{model}|{prompt}|{context or ''}".encode()
+        return "llm:" + hashlib.blake2b(data, digest_size=16).hexdigest()
+    
+    def _get_cached_response(self, key: str) -> Optional[str]:
+        with self._cache_lock:
+            entry = self._response_cache.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._response_cache[key]
+                return None
+            self._response_cache.move_to_end(key)
+            return entry[1]
+    
+    def _set_cached_response(self, key: str, response: str):
+        if settings.llm_cache_ttl <= 0 or settings.llm_cache_size <= 0:
+            return
+        with self._cache_lock:
+            self._response_cache[key] = (time.monotonic() + settings.llm_cache_ttl, response)
+            self._response_cache.move_to_end(key)
+            while len(self._response_cache) > settings.llm_cache_size:
+                self._response_cache.popitem(last=False)
+    
     async def _generate_gemini_response(self, prompt: str, context: Optional[str] = None) -> str:
         """Generate response using Gemini"""
         try:
@@ -75,7 +140,7 @@ class LLMService:
                 full_prompt = f"Context: {context}\n\nQuestion: {prompt}"
             
             response = self.openai_client.ChatCompletion.create(
-                model="gpt-3.5-turbo",
+                model=OPENAI_MODEL,
                 messages=[
                     {"role": "system", "content": "You are a helpful AI assistant. Provide accurate and helpful responses based on the context provided."},
                     {"role": "user", "content": full_prompt}
@@ -98,9 +163,12 @@ class LLMService:
     
     def get_available_models(self) -> Dict[str, bool]:
         """Get status of available LLM models"""
+        # Report configured providers without forcing their SDKs to load
+        gemini = self.gemini_client is not None if self._gemini_initialized else bool(settings.gemini_api_key)
+        openai = self.openai_client is not None if self._openai_initialized else bool(settings.openai_api_key)
         return {
-            "gemini": self.gemini_client is not None,
-            "openai": self.openai_client is not None,
+            "gemini": gemini,
+            "openai": openai,
             "mock": True  # Always available as fallback
         }
 
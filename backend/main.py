@@ -1,14 +1,21 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.security import HTTPBearer
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional
 import uvicorn
+import asyncio
 from datetime import datetime
-import uuid
 import os
+import io
+import codecs
+import tempfile
 from sqlalchemy.orm import Session
-from database import get_db
+from config import settings
+from database import get_db, get_db_context
+from models import ChatSession as ChatSessionRecord, Message as MessageRecord, generate_uuid
 from rag_service import rag_service
 from llm_service import llm_service
 
@@ -16,7 +23,8 @@ from llm_service import llm_service
 app = FastAPI(
     title="AI Chat Support API",
     description="Backend API for AI Chat Support Widget",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware for frontend integration
@@ -64,28 +72,68 @@ async def root():
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.utcnow()}
 
+def _to_message(record: MessageRecord) -> Message:
+    return Message(
+        id=record.id,
+        session_id=record.session_id,
+        sender=record.sender,
+        content=record.content,
+        timestamp=record.timestamp
+    )
+
+def _store_user_message(session_id: str, tenant_id: Optional[str], content: str):
+    """Create the session if needed and store the user's message"""
+    with get_db_context() as db:
+        session = db.query(ChatSessionRecord).filter(ChatSessionRecord.id == session_id).first()
+        if session is None:
+            session = ChatSessionRecord(
+                id=session_id,
+                tenant_id=tenant_id,
+                created_at=datetime.utcnow()
+            )
+            db.add(session)
+        session.last_activity = datetime.utcnow()
+        
+        db.add(MessageRecord(
+            session_id=session_id,
+            sender="user",
+            content=content,
+            timestamp=datetime.utcnow()
+        ))
+
+def _build_context_prompt(query: str, tenant_id: str) -> str:
+    """Use RAG to find relevant context and build the LLM prompt"""
+    with get_db_context() as db:
+        relevant_chunks = rag_service.search_similar_chunks(db, query, tenant_id, limit=3)
+    return rag_service.generate_context_prompt(query, relevant_chunks)
+
+def _store_bot_message(session_id: str, content: str):
+    """Store the bot's reply and update session activity"""
+    with get_db_context() as db:
+        db.add(MessageRecord(
+            session_id=session_id,
+            sender="bot",
+            content=content,
+            timestamp=datetime.utcnow()
+        ))
+        db.query(ChatSessionRecord).filter(ChatSessionRecord.id == session_id).update(
+            {ChatSessionRecord.last_activity: datetime.utcnow()}
+        )
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest, db: Session = Depends(get_db)):
+async def chat(request: ChatRequest, background_tasks: BackgroundTasks):
     """Send a message and get AI response using RAG and LLM"""
     # Generate session ID if not provided
-    session_id = request.session_id or str(uuid.uuid4())
-    
-    # Store user message
-    user_message = Message(
-        id=str(uuid.uuid4()),
-        session_id=session_id,
-        sender="user",
-        content=request.message,
-        timestamp=datetime.utcnow()
-    )
-    messages[session_id] = messages.get(session_id, []) + [user_message]
-    
-    # Use RAG to find relevant context
+    session_id = request.session_id or generate_uuid()
     tenant_id = request.tenant_id or "default"
-    relevant_chunks = rag_service.search_similar_chunks(db, request.message, tenant_id, limit=3)
     
-    # Generate context-aware prompt
-    context_prompt = rag_service.generate_context_prompt(request.message, relevant_chunks)
+    # Database work runs in the threadpool with short-lived sessions, so no
+    # connection is checked out while waiting on the LLM. Storing the user
+    # message and retrieving context are independent, so they run concurrently.
+    _, context_prompt = await asyncio.gather(
+        run_in_threadpool(_store_user_message, session_id, request.tenant_id, request.message),
+        run_in_threadpool(_build_context_prompt, request.message, tenant_id)
+    )
     
     # Generate AI response using LLM
     try:
@@ -94,52 +142,50 @@ async def chat(request: ChatRequest, db: Session = Depends(get_db)):
         print(f"LLM error: {e}")
         bot_response = f"Thanks for your message: '{request.message}'. This is a fallback response."
     
-    # Store bot response
-    bot_message = Message(
-        id=str(uuid.uuid4()),
-        session_id=session_id,
-        sender="bot",
-        content=bot_response,
-        timestamp=datetime.utcnow()
-    )
-    messages[session_id] = messages.get(session_id, []) + [bot_message]
-    
-    # Update session
-    sessions[session_id] = ChatSession(
-        session_id=session_id,
-        tenant_id=request.tenant_id,
-        created_at=sessions.get(session_id, {}).get('created_at', datetime.utcnow()),
-        last_activity=datetime.utcnow()
-    )
+    # Persist the reply after the response has been sent to the client
+    background_tasks.add_task(_store_bot_message, session_id, bot_response)
     
     return ChatResponse(message=bot_response, session_id=session_id)
 
 @app.get("/chat/{session_id}/messages", response_model=List[Message])
-async def get_messages(session_id: str):
+def get_messages(session_id: str, db: Session = Depends(get_db)):
     """Get chat history for a session"""
-    if session_id not in messages:
+    if db.query(ChatSessionRecord.id).filter(ChatSessionRecord.id == session_id).first() is None:
         raise HTTPException(status_code=404, detail="Session not found")
-    return messages[session_id]
+    
+    records = db.query(MessageRecord).filter(
+        MessageRecord.session_id == session_id
+    ).order_by(MessageRecord.timestamp).all()
+    return [_to_message(record) for record in records]
 
 @app.post("/sessions")
-async def create_session(tenant_id: Optional[str] = None):
+def create_session(tenant_id: Optional[str] = None, db: Session = Depends(get_db)):
     """Create a new chat session"""
-    session_id = str(uuid.uuid4())
-    sessions[session_id] = ChatSession(
-        session_id=session_id,
+    session_id = generate_uuid()
+    db.add(ChatSessionRecord(
+        id=session_id,
         tenant_id=tenant_id,
         created_at=datetime.utcnow(),
         last_activity=datetime.utcnow()
-    )
-    messages[session_id] = []
+    ))
+    db.commit()
     return {"session_id": session_id}
 
 @app.get("/sessions/{session_id}")
-async def get_session(session_id: str):
+def get_session(session_id: str, db: Session = Depends(get_db)):
     """Get session details"""
-    if session_id not in sessions:
+    session = db.query(ChatSessionRecord).filter(ChatSessionRecord.id == session_id).first()
+    if session is None:
         raise HTTPException(status_code=404, detail="Session not found")
-    return sessions[session_id]
+    return ChatSession(
+        session_id=session.id,
+        tenant_id=session.tenant_id,
+        user_id=session.user_id,
+        created_at=session.created_at,
+        last_activity=session.last_activity
+    )
+
+UPLOAD_READ_SIZE = 64 * 1024
 
 @app.post("/documents/upload")
 async def upload_document(
@@ -155,30 +201,50 @@ async def upload_document(
         if file_ext not in allowed_types:
             raise HTTPException(status_code=400, detail=f"File type {file_ext} not allowed")
         
-        # Read file content (simplified - in production, use proper text extraction)
-        content = await file.read()
-        if file_ext == ".txt":
-            text_content = content.decode('utf-8')
-        else:
-            # For other file types, you'd use libraries like PyPDF2, python-docx, etc.
-            text_content = f"Content from {file.filename} (processing not implemented for {file_ext})"
-        
-        # Create document record
-        from models import KnowledgeDocument
-        document = KnowledgeDocument(
-            tenant_id=tenant_id,
-            filename=file.filename,
-            file_path=f"uploads/{file.filename}",
-            file_type=file_ext,
-            file_size=len(content),
-            is_processed=False
-        )
-        db.add(document)
-        db.commit()
-        db.refresh(document)
-        
-        # Process document with RAG
-        success = rag_service.process_document(db, document.id, text_content)
+        with tempfile.TemporaryFile() as upload:
+            # Stream the upload to disk so it is never fully held in memory.
+            # Text files are validated as UTF-8 on the way, so a bad file is
+            # rejected before any document record is written.
+            decoder = codecs.getincrementaldecoder("utf-8")() if file_ext == ".txt" else None
+            file_size = 0
+            try:
+                while chunk := await file.read(UPLOAD_READ_SIZE):
+                    file_size += len(chunk)
+                    if file_size > settings.max_file_size:
+                        raise HTTPException(status_code=413, detail="File too large")
+                    if decoder:
+                        decoder.decode(chunk)
+                    upload.write(chunk)
+                if decoder:
+                    decoder.decode(b"", final=True)
+            except UnicodeDecodeError:
+                raise HTTPException(status_code=400, detail="Text files must be UTF-8 encoded")
+            upload.seek(0)
+            
+            # Read file content (simplified - in production, use proper text extraction)
+            if file_ext == ".txt":
+                # newline="" keeps line endings exactly as uploaded
+                text_content = io.TextIOWrapper(upload, encoding="utf-8", newline="")
+            else:
+                # For other file types, you'd use libraries like PyPDF2, python-docx, etc.
+                text_content = f"Content from {file.filename} (processing not implemented for {file_ext})"
+            
+            # Create document record
+            from models import KnowledgeDocument
+            document = KnowledgeDocument(
+                tenant_id=tenant_id,
+                filename=file.filename,
+                file_path=f"uploads/{file.filename}",
+                file_type=file_ext,
+                file_size=file_size,
+                is_processed=False
+            )
+            db.add(document)
+            db.commit()
+            db.refresh(document)
+            
+            # Process document with RAG, chunking straight from the temporary file
+            success = await run_in_threadpool(rag_service.process_document, db, document.id, text_content)
         
         if success:
             return {
@@ -188,7 +254,9 @@ async def upload_document(
             }
         else:
             raise HTTPException(status_code=500, detail="Failed to process document")
-            
+    
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
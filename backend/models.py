@@ -1,13 +1,84 @@
-from sqlalchemy import Column, String, DateTime, Text, Integer, ForeignKey, Boolean, Float
+from sqlalchemy import Column, String, DateTime, Text, Integer, ForeignKey, Boolean, Float, LargeBinary, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
-import uuid
+import numpy as np
+
+try:
+    # Time-ordered ids keep primary-key inserts at the right edge of the B-tree
+    from uuid_utils import uuid7 as _new_uuid
+except ImportError:
+    from uuid import uuid4 as _new_uuid
+
+try:
+    from pgvector.sqlalchemy import Vector
+except ImportError:
+    Vector = None
 
 Base = declarative_base()
 
+EMBEDDING_DIMENSION = 384  # sentence-transformers/all-MiniLM-L6-v2
+
 def generate_uuid():
-    return str(uuid.uuid4())
+    return str(_new_uuid())
+
+PGVECTOR_AVAILABLE = Vector is not None
+
+def uses_pgvector(dialect) -> bool:
+    """Whether embeddings are stored in a pgvector column for this dialect.
+    
+    Needs both the pgvector package and the server-side ``vector`` extension;
+    database.py records the latter on the dialect once per engine.
+    """
+    return (
+        PGVECTOR_AVAILABLE
+        and dialect.name == "postgresql"
+        and getattr(dialect, "has_vector_extension", False)
+    )
+
+class Embedding(TypeDecorator):
+    """Embedding vector column.
+
+    Stored as a pgvector ``vector`` on PostgreSQL so similarity search runs in
+    the database, and as raw little-endian float32 bytes everywhere else.
+    Values are read back as float32 numpy arrays either way. Existing
+    PostgreSQL tables are not converted automatically: a bytea/text
+    ``embedding`` column must be migrated to ``vector(384)`` (or the chunks
+    reprocessed) before pgvector search is used.
+    """
+    impl = LargeBinary
+    cache_ok = True
+    
+    class comparator_factory(LargeBinary.Comparator):
+        def cosine_distance(self, other):
+            return self.op("<=>", return_type=Float)(other)
+    
+    def __init__(self, dimension: int = EMBEDDING_DIMENSION):
+        super().__init__()
+        self.dimension = dimension
+    
+    def load_dialect_impl(self, dialect):
+        if uses_pgvector(dialect):
+            return dialect.type_descriptor(Vector(self.dimension))
+        return dialect.type_descriptor(LargeBinary())
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if uses_pgvector(dialect):
+            return np.asarray(value, dtype=np.float32)
+        return np.asarray(value, dtype="<f4").tobytes()
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if uses_pgvector(dialect):
+            return np.asarray(value, dtype=np.float32)
+        # Rows written before the binary format (e.g. JSON text) read as missing
+        if not isinstance(value, (bytes, bytearray, memoryview)) or len(value) % 4:
+            return None
+        return np.frombuffer(value, dtype="<f4")
 
 class Tenant(Base):
     __tablename__ = "tenants"
@@ -43,7 +114,7 @@ class ChatSession(Base):
     __tablename__ = "chat_sessions"
     
     id = Column(String, primary_key=True, default=generate_uuid)
-    tenant_id = Column(String, ForeignKey("tenants.id"))
+    tenant_id = Column(String, ForeignKey("tenants.id"), index=True)
     user_id = Column(String, ForeignKey("users.id"), nullable=True)
     anonymous_id = Column(String, nullable=True)  # For anonymous sessions
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -59,7 +130,7 @@ class Message(Base):
     __tablename__ = "messages"
     
     id = Column(String, primary_key=True, default=generate_uuid)
-    session_id = Column(String, ForeignKey("chat_sessions.id"), nullable=False)
+    session_id = Column(String, ForeignKey("chat_sessions.id"), nullable=False, index=True)
     sender = Column(String, nullable=False)  # 'user' or 'bot'
     content = Column(Text, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
@@ -70,6 +141,12 @@ class Message(Base):
 
 class KnowledgeDocument(Base):
     __tablename__ = "knowledge_documents"
+    __table_args__ = (
+        # Tenant filter used by similarity search; INCLUDE (id) lets PostgreSQL
+        # answer it from the index alone
+        Index("ix_kd_tenant_active_processed", "tenant_id", "is_active", "is_processed",
+              postgresql_include=["id"]),
+    )
     
     id = Column(String, primary_key=True, default=generate_uuid)
     tenant_id = Column(String, ForeignKey("tenants.id"), nullable=False)
@@ -88,12 +165,15 @@ class KnowledgeDocument(Base):
 
 class DocumentChunk(Base):
     __tablename__ = "document_chunks"
+    __table_args__ = (
+        Index("ix_dc_document_id", "document_id"),
+    )
     
     id = Column(String, primary_key=True, default=generate_uuid)
     document_id = Column(String, ForeignKey("knowledge_documents.id"), nullable=False)
     content = Column(Text, nullable=False)
     chunk_index = Column(Integer, nullable=False)
-    embedding = Column(Text)  # JSON string of embedding vector
+    embedding = Column(Embedding(EMBEDDING_DIMENSION))
     chunk_metadata = Column(Text)  # JSON string for additional data
     
     # Relationships
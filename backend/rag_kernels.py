@@ -0,0 +1,47 @@
+"""
+Compiled scoring kernels for the in-process similarity search.
+
+Used when pgvector is unavailable (SQLite, or PostgreSQL without the
+extension). Numba is optional; without it RAGService scores with NumPy.
+"""
+
+import threading
+import numpy as np
+
+try:
+    import numba
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+if NUMBA_AVAILABLE:
+    # OpenMP first, then the built-in workqueue (always present). TBB goes last:
+    # when its scheduler is first started from a threadpool worker rather than
+    # the main thread, it can keep the process from exiting.
+    numba.config.THREADING_LAYER_PRIORITY = ["omp", "workqueue", "tbb"]
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _score_quantized(codes, scales, query):
+        n, dim = codes.shape
+        similarities = np.empty(n, dtype=np.float32)
+        for i in prange(n):
+            acc = np.float32(0.0)
+            for j in range(dim):
+                acc += np.float32(codes[i, j]) * query[j]
+            similarities[i] = acc * scales[i]
+        return similarities
+
+# Callers run in FastAPI's threadpool. The workqueue layer aborts the process
+# on concurrent use, and a single call already uses every core, so calls are
+# serialized.
+_kernel_lock = threading.Lock()
+
+def score_quantized(codes: np.ndarray, scales: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Cosine scores of a query against int8 codes with per-row scales.
+
+    Dequantization, the dot product and scaling are fused into one pass
+    over each row, spread across all cores.
+    """
+    with _kernel_lock:
+        return _score_quantized(codes, scales, query)
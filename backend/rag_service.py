@@ -1,63 +1,167 @@
-import json
+import functools
 import os
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from itertools import islice
+from typing import List, Dict, Any, Optional, Tuple, Iterator, TextIO, Union
 from datetime import datetime
 import numpy as np
+import orjson
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
-from models import KnowledgeDocument, DocumentChunk
+from models import KnowledgeDocument, DocumentChunk, EMBEDDING_DIMENSION, uses_pgvector
 from config import settings
 
+# Rows dequantized per step when scoring the int8 embedding cache
+SCORE_BLOCK_ROWS = 4096
+
+# Columns returned for matched chunks; embeddings are never needed past scoring
+RESULT_COLUMNS = (
+    DocumentChunk.id,
+    DocumentChunk.content,
+    DocumentChunk.document_id,
+    DocumentChunk.chunk_metadata,
+)
+
+class _FallbackEmbedding(Exception):
+    """Carries a fallback query embedding past the LRU cache without memoizing it"""
+    def __init__(self, embedding: np.ndarray):
+        super().__init__()
+        self.embedding = embedding
+
 class RAGService:
     def __init__(self):
         self.embedding_model = None
-        self.vector_dimension = 384  # Default for sentence-transformers/all-MiniLM-L6-v2
+        self._model_lock = threading.Lock()
+        self.vector_dimension = EMBEDDING_DIMENSION
+        # tenant_id -> (loaded_at, chunk ids, int8 embedding codes, per-row scales)
+        self._emb_cache: Dict[str, Tuple[float, List[str], np.ndarray, np.ndarray]] = {}
+        # Bumped on invalidation so a load that raced a document update isn't cached
+        self._emb_generations: Dict[str, int] = {}
+        self._emb_global_generation = 0
+        self._emb_cache_lock = threading.Lock()
+        # Repeated questions skip the transformer forward pass
+        self._encode_query_cached = functools.lru_cache(
+            maxsize=settings.query_embedding_cache_size
+        )(self._encode_query)
+        # Numba kernels are imported on the first large enough scan
+        self._kernels = None
+        self._kernels_loaded = False
+        self._kernels_lock = threading.Lock()
         
     def _load_embedding_model(self):
         """Lazy load the embedding model"""
-        if self.embedding_model is None:
-            try:
-                from sentence_transformers import SentenceTransformer
-                self.embedding_model = SentenceTransformer(settings.embedding_model)
-                print(f"Loaded embedding model: {settings.embedding_model}")
-            except ImportError:
-                print("Warning: sentence-transformers not available. Using mock embeddings.")
-                self.embedding_model = "mock"
-    
-    def generate_embedding(self, text: str) -> List[float]:
-        """Generate embedding for a text"""
+        if self.embedding_model is not None:
+            return
+        
+        # Concurrent first requests must not each load their own copy
+        with self._model_lock:
+            if self.embedding_model is None:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                    model = None
+                    if settings.embedding_backend == "onnx":
+                        # ONNX Runtime with INT8-quantized weights is several times
+                        # faster than PyTorch fp32 on CPU
+                        try:
+                            model = SentenceTransformer(
+                                settings.embedding_model,
+                                backend="onnx",
+                                model_kwargs={"file_name": settings.embedding_onnx_file}
+                            )
+                        except Exception as e:
+                            print(f"Warning: ONNX embedding backend unavailable ({e}). Falling back to PyTorch.")
+                    if model is None:
+                        model = SentenceTransformer(settings.embedding_model)
+                    self.vector_dimension = model.get_sentence_embedding_dimension()
+                    self.embedding_model = model
+                    print(f"Loaded embedding model: {settings.embedding_model} ({getattr(model, 'backend', 'torch')})")
+                except ImportError:
+                    print("Warning: sentence-transformers not available. Using mock embeddings.")
+                    self.embedding_model = "mock"
+    
+    def generate_embedding(self, text: str) -> np.ndarray:
+        """Generate a float32 embedding for a text"""
+        return self.generate_embeddings([text])[0]
+    
+    def _encode_query(self, text: str) -> bytes:
+        embeddings, from_model = self._encode([text])
+        if not from_model:
+            # Raising keeps the fallback vector out of the LRU cache
+            raise _FallbackEmbedding(embeddings[0])
+        return embeddings[0].tobytes()
+    
+    def embed_query(self, query: str) -> np.ndarray:
+        """Embed a search query, reusing cached embeddings for repeated queries"""
+        key = query.strip().lower()
+        try:
+            return np.frombuffer(self._encode_query_cached(key), dtype=np.float32)
+        except _FallbackEmbedding as e:
+            return e.embedding
+    
+    def generate_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Generate L2-normalized float32 embeddings for a batch of texts"""
+        return self._encode(texts)[0]
+    
+    def _encode(self, texts: List[str]) -> Tuple[np.ndarray, bool]:
+        """Encode texts; the flag is False when the encoder failed and a fallback was returned"""
         self._load_embedding_model()
         
         if self.embedding_model == "mock":
             # Mock embedding for development
-            return [0.1] * self.vector_dimension
+            return np.full((len(texts), self.vector_dimension), 0.1, dtype=np.float32), True
         
         try:
-            embedding = self.embedding_model.encode(text)
-            return embedding.tolist()
+            embeddings = self.embedding_model.encode(
+                texts,
+                batch_size=settings.embedding_batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            )
+            return np.asarray(embeddings, dtype=np.float32), True
         except Exception as e:
-            print(f"Error generating embedding: {e}")
-            return [0.1] * self.vector_dimension
+            print(f"Error generating embeddings: {e}")
+            return np.full((len(texts), self.vector_dimension), 0.1, dtype=np.float32), False
     
-    def chunk_text(self, text: str, chunk_size: int = None, overlap: int = None) -> List[str]:
-        """Split text into overlapping chunks"""
+    def iter_chunks(self, text: Union[str, TextIO], chunk_size: int = None, overlap: int = None) -> Iterator[str]:
+        """Yield overlapping chunks of text from a string or a text stream"""
         chunk_size = chunk_size or settings.chunk_size
-        overlap = overlap or settings.chunk_overlap
+        # A negative overlap would skip text between chunks
+        overlap = max(0, settings.chunk_overlap if overlap is None else overlap)
         
-        chunks = []
-        start = 0
+        # Always advance, even when overlap >= chunk_size
+        step = max(1, chunk_size - overlap)
         
+        if not isinstance(text, str):
+            yield from self._iter_stream_chunks(text, chunk_size, step)
+            return
+        
+        start = 0
         while start < len(text):
-            end = start + chunk_size
-            chunk = text[start:end]
-            chunks.append(chunk)
-            start = end - overlap
-            
-            if start >= len(text):
+            yield text[start:start + chunk_size]
+            if start + chunk_size >= len(text):
                 break
-        
-        return chunks
+            start += step
+    
+    def _iter_stream_chunks(self, stream: TextIO, chunk_size: int, step: int) -> Iterator[str]:
+        """Chunk a text stream while holding only the current chunk in memory"""
+        chunk = stream.read(chunk_size)
+        while chunk:
+            yield chunk
+            if len(chunk) < chunk_size:
+                break
+            more = stream.read(step)
+            if not more:
+                break
+            chunk = chunk[step:] + more
+    
+    def chunk_text(self, text: str, chunk_size: int = None, overlap: int = None) -> List[str]:
+        """Split text into overlapping chunks"""
+        return list(self.iter_chunks(text, chunk_size, overlap))
     
-    def process_document(self, db: Session, document_id: str, content: str) -> bool:
+    def process_document(self, db: Session, document_id: str, content: Union[str, TextIO]) -> bool:
         """Process a document and store its chunks with embeddings"""
         try:
             # Get document
@@ -68,31 +172,40 @@ class RAGService:
             # Clear existing chunks
             db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id).delete()
             
-            # Split into chunks
-            chunks = self.chunk_text(content)
-            
-            # Create chunks with embeddings
-            for i, chunk_content in enumerate(chunks):
-                embedding = self.generate_embedding(chunk_content)
+            # Embed and insert chunks one batch at a time so only a single
+            # batch of chunks is held in memory
+            chunks = self.iter_chunks(content)
+            chunk_count = 0
+            while True:
+                batch = list(islice(chunks, settings.embedding_batch_size))
+                if not batch:
+                    break
                 
-                chunk = DocumentChunk(
-                    document_id=document_id,
-                    content=chunk_content,
-                    chunk_index=i,
-                    embedding=json.dumps(embedding),
-                    chunk_metadata=json.dumps({
-                        "chunk_size": len(chunk_content),
-                        "processed_at": datetime.utcnow().isoformat()
-                    })
-                )
+                embeddings = self.generate_embeddings(batch)
                 
-                db.add(chunk)
+                # Insert the batch with one executemany instead of per-object flushes
+                rows = [
+                    {
+                        "document_id": document_id,
+                        "content": chunk_content,
+                        "chunk_index": chunk_count + i,
+                        "embedding": embedding,
+                        "chunk_metadata": orjson.dumps({
+                            "chunk_size": len(chunk_content),
+                            "processed_at": datetime.utcnow()
+                        }).decode()
+                    }
+                    for i, (chunk_content, embedding) in enumerate(zip(batch, embeddings))
+                ]
+                db.execute(insert(DocumentChunk), rows)
+                chunk_count += len(batch)
             
             # Mark document as processed
             document.is_processed = True
             db.commit()
+            self.invalidate_cache(document.tenant_id)
             
-            print(f"Processed document {document_id}: {len(chunks)} chunks created")
+            print(f"Processed document {document_id}: {chunk_count} chunks created")
             return True
             
         except Exception as e:
@@ -100,47 +213,188 @@ class RAGService:
             db.rollback()
             return False
     
+    def invalidate_cache(self, tenant_id: Optional[str] = None):
+        """Drop the cached embedding matrix for a tenant (or all tenants)"""
+        with self._emb_cache_lock:
+            if tenant_id is None:
+                self._emb_cache.clear()
+                self._emb_global_generation += 1
+            else:
+                self._emb_cache.pop(tenant_id, None)
+                self._emb_generations[tenant_id] = self._emb_generations.get(tenant_id, 0) + 1
+    
+    def _cache_generation(self, tenant_id: str) -> Tuple[int, int]:
+        return self._emb_global_generation, self._emb_generations.get(tenant_id, 0)
+    
+    def _get_embedding_matrix(self, db: Session, tenant_id: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """Load the tenant's row-normalized chunk embeddings, quantized to int8.
+        
+        Returns the chunk ids, an (N, dim) int8 code matrix and the per-row
+        float32 scales such that ``codes[i] * scales[i]`` approximates row i.
+        """
+        cached = self._emb_cache.get(tenant_id)
+        if cached and time.monotonic() - cached[0] < settings.embedding_cache_ttl:
+            return cached[1], cached[2], cached[3]
+        
+        with self._emb_cache_lock:
+            generation = self._cache_generation(tenant_id)
+        
+        rows = db.execute(
+            select(DocumentChunk.id, DocumentChunk.embedding)
+            .join(KnowledgeDocument, DocumentChunk.document_id == KnowledgeDocument.id)
+            .where(*self._searchable_documents(tenant_id))
+        ).all()
+        
+        # Skip chunks without an embedding or from a model of a different dimension
+        rows = [(chunk_id, embedding) for chunk_id, embedding in rows
+                if embedding is not None and embedding.shape == (self.vector_dimension,)]
+        ids = [chunk_id for chunk_id, _ in rows]
+        
+        matrix = np.empty((len(rows), self.vector_dimension), dtype=np.float32)
+        for i, (_, embedding) in enumerate(rows):
+            matrix[i] = embedding
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix /= norms
+        
+        # Symmetric per-row int8 quantization: a quarter of the float32 footprint
+        scales = np.abs(matrix).max(axis=1, initial=0.0) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.rint(matrix / scales[:, None]).astype(np.int8)
+        scales = scales.astype(np.float32)
+        
+        # If the tenant's documents changed while loading, this matrix may be
+        # stale: return it for this query but leave the cache empty
+        with self._emb_cache_lock:
+            if self._cache_generation(tenant_id) == generation:
+                self._emb_cache[tenant_id] = (time.monotonic(), ids, codes, scales)
+        return ids, codes, scales
+    
+    def _get_kernels(self):
+        """Lazily import the Numba kernels; None when Numba isn't installed"""
+        if not self._kernels_loaded:
+            with self._kernels_lock:
+                if not self._kernels_loaded:
+                    import rag_kernels
+                    self._kernels = rag_kernels if rag_kernels.NUMBA_AVAILABLE else None
+                    self._kernels_loaded = True
+        return self._kernels
+    
+    def _score_quantized(self, codes: np.ndarray, scales: np.ndarray, query_vector: np.ndarray) -> np.ndarray:
+        """Dot the query against int8 codes, dequantizing one block at a time"""
+        if codes.size >= settings.numba_scoring_threshold:
+            kernels = self._get_kernels()
+            if kernels is not None:
+                try:
+                    return kernels.score_quantized(codes, scales, np.ascontiguousarray(query_vector, dtype=np.float32))
+                except Exception as e:
+                    # e.g. no threading layer could be loaded
+                    print(f"Warning: Numba scoring kernel unavailable ({e}). Using NumPy.")
+                    self._kernels = None
+        
+        similarities = np.empty(codes.shape[0], dtype=np.float32)
+        for start in range(0, codes.shape[0], SCORE_BLOCK_ROWS):
+            block = codes[start:start + SCORE_BLOCK_ROWS]
+            similarities[start:start + len(block)] = block.astype(np.float32) @ query_vector
+        similarities *= scales
+        return similarities
+    
+    def _searchable_documents(self, tenant_id: str) -> tuple:
+        """Filter for the tenant's active, processed documents"""
+        return (
+            KnowledgeDocument.tenant_id == tenant_id,
+            KnowledgeDocument.is_active == True,
+            KnowledgeDocument.is_processed == True
+        )
+    
+    def _search_pgvector(self, db: Session, query_vector: np.ndarray, tenant_id: str, limit: int) -> List[Tuple[Row, float]]:
+        """Let PostgreSQL return the top-k chunks through the pgvector index"""
+        distance = DocumentChunk.embedding.cosine_distance(query_vector)
+        searchable = self._searchable_documents(tenant_id)
+        query = (
+            select(*RESULT_COLUMNS, distance.label("distance"))
+            .join(KnowledgeDocument, DocumentChunk.document_id == KnowledgeDocument.id)
+            .where(*searchable)
+            .order_by(distance)
+            .limit(limit)
+        )
+        
+        # The tenant filter is applied to the HNSW scan's candidates, so a
+        # small tenant can get fewer than `limit` rows from a shared index.
+        # Widen the candidate list, and on pgvector 0.8+ keep scanning until
+        # enough rows pass the filter.
+        db.execute(text(f"SET LOCAL hnsw.ef_search = {max(settings.hnsw_ef_search, limit)}"))
+        if (getattr(db.get_bind().dialect, "vector_extension_version", None) or ()) >= (0, 8):
+            db.execute(text("SET LOCAL hnsw.iterative_scan = strict_order"))
+        rows = db.execute(query).all()
+        
+        if len(rows) < limit:
+            available = db.execute(
+                select(func.count()).select_from(
+                    select(DocumentChunk.id)
+                    .join(KnowledgeDocument, DocumentChunk.document_id == KnowledgeDocument.id)
+                    .where(*searchable)
+                    .limit(limit)
+                    .subquery()
+                )
+            ).scalar_one()
+            if available > len(rows):
+                # The index missed some of the tenant's chunks; rank them exactly
+                db.execute(text("SET LOCAL enable_indexscan = off"))
+                rows = db.execute(query).all()
+                db.execute(text("SET LOCAL enable_indexscan = on"))
+        
+        return [(row, 1.0 - float(row.distance)) for row in rows]
+    
+    def _search_in_memory(self, db: Session, query_vector: np.ndarray, tenant_id: str, limit: int) -> List[Tuple[Row, float]]:
+        """Score the tenant's cached embedding matrix in-process"""
+        ids, codes, scales = self._get_embedding_matrix(db, tenant_id)
+        if not ids or query_vector.shape[0] != codes.shape[1]:
+            return []
+        
+        norm = np.linalg.norm(query_vector)
+        if norm > 0:
+            query_vector = query_vector / norm
+        
+        # Cosine similarity against every chunk, block by block
+        similarities = self._score_quantized(codes, scales, query_vector)
+        
+        # Select the top-k without sorting the whole array
+        k = min(limit, len(ids))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        
+        # Only the winners' content and metadata are fetched
+        top_ids = [ids[i] for i in top]
+        chunks = {
+            row.id: row
+            for row in db.execute(select(*RESULT_COLUMNS).where(DocumentChunk.id.in_(top_ids)))
+        }
+        
+        return [(chunks[ids[i]], float(similarities[i])) for i in top if ids[i] in chunks]
+    
     def search_similar_chunks(self, db: Session, query: str, tenant_id: str, limit: int = 5) -> List[Dict[str, Any]]:
         """Search for similar document chunks based on query"""
         try:
-            # Generate query embedding
-            query_embedding = self.generate_embedding(query)
-            
-            # Get all chunks for the tenant
-            chunks = db.query(DocumentChunk).join(KnowledgeDocument).filter(
-                KnowledgeDocument.tenant_id == tenant_id,
-                KnowledgeDocument.is_active == True,
-                KnowledgeDocument.is_processed == True
-            ).all()
-            
-            if not chunks:
+            if limit <= 0:
                 return []
             
-            # Calculate similarities
-            similarities = []
-            for chunk in chunks:
-                try:
-                    chunk_embedding = json.loads(chunk.embedding)
-                    similarity = self._cosine_similarity(query_embedding, chunk_embedding)
-                    similarities.append({
-                        'chunk': chunk,
-                        'similarity': similarity
-                    })
-                except (json.JSONDecodeError, TypeError):
-                    continue
+            # Generate query embedding
+            query_vector = self.embed_query(query)
             
-            # Sort by similarity and return top results
-            similarities.sort(key=lambda x: x['similarity'], reverse=True)
+            if uses_pgvector(db.get_bind().dialect):
+                matches = self._search_pgvector(db, query_vector, tenant_id, limit)
+            else:
+                matches = self._search_in_memory(db, query_vector, tenant_id, limit)
             
             results = []
-            for item in similarities[:limit]:
-                chunk = item['chunk']
+            for chunk, similarity in matches:
                 results.append({
                     'id': chunk.id,
                     'content': chunk.content,
                     'document_id': chunk.document_id,
-                    'similarity': item['similarity'],
-                    'metadata': json.loads(chunk.chunk_metadata) if chunk.chunk_metadata else {}
+                    'similarity': similarity,
+                    'metadata': orjson.loads(chunk.chunk_metadata) if chunk.chunk_metadata else {}
                 })
             
             return results
@@ -149,23 +403,6 @@ class RAGService:
             print(f"Error searching chunks: {e}")
             return []
     
-    def _cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
-        """Calculate cosine similarity between two vectors"""
-        try:
-            vec1 = np.array(vec1)
-            vec2 = np.array(vec2)
-            
-            dot_product = np.dot(vec1, vec2)
-            norm1 = np.linalg.norm(vec1)
-            norm2 = np.linalg.norm(vec2)
-            
-            if norm1 == 0 or norm2 == 0:
-                return 0.0
-            
-            return dot_product / (norm1 * norm2)
-        except Exception:
-            return 0.0
-    
     def generate_context_prompt(self, query: str, relevant_chunks: List[Dict[str, Any]]) -> str:
         """Generate a context-aware prompt for the LLM"""
         if not relevant_chunks:
@@ -6,8 +6,8 @@ This script helps configure and initialize the Supabase database
 import os
 import sys
 from sqlalchemy import create_engine, text
-from database import DATABASE_URL
-from models import Base
+from database import DATABASE_URL, enable_vector_extension, create_vector_index
+from models import Base, uses_pgvector
 
 def setup_supabase():
     """Setup Supabase database connection and tables"""
@@ -27,10 +27,20 @@ def setup_supabase():
             result = conn.execute(text("SELECT version()"))
             print(f"✅ Connected to database: {result.fetchone()[0]}")
         
+        # Enable pgvector for in-database similarity search
+        if enable_vector_extension(engine):
+            print("✅ pgvector extension enabled")
+        else:
+            print("⚠️  pgvector search disabled. Similarity search will run in Python.")
+        
         # Create tables
         Base.metadata.create_all(bind=engine)
         print("✅ Database tables created successfully")
         
+        if uses_pgvector(engine.dialect):
+            create_vector_index(engine)
+            print("✅ HNSW embedding index created")
+        
         # Create initial tenant
         with engine.connect() as conn:
             conn.execute(text("""
@@ -79,6 +89,8 @@ MAX_FILE_SIZE=10485760
 
 # RAG Configuration
 EMBEDDING_MODEL=sentence-transformers/all-MiniLM-L6-v2
+EMBEDDING_BACKEND=onnx
+EMBEDDING_ONNX_FILE=onnx/model_qint8_avx512_vnni.onnx
 CHUNK_SIZE=1000
 CHUNK_OVERLAP=200
 """